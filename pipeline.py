@@ -7,255 +7,810 @@ Supports two modes:
 2. Local: Uses documents from mounted PVC
 """
 from kfp import dsl, compiler
-from kfp.dsl import component, Input, Output, Dataset
+from kfp.dsl import component, Input, Output, Dataset, Metrics
 from typing import List, Optional
 
 
+@component(
+    base_image="registry.access.redhat.com/ubi9/python-311:latest"
+)
+def plan_shards(num_shards: int) -> List[int]:
+    """List the shard indices to fan ingestion out over"""
+    return list(range(num_shards))
+
+
 @component(
     base_image="registry.access.redhat.com/ubi9/python-311:latest",
-    packages_to_install=["boto3"]
+    packages_to_install=["aiohttp", "boto3", "charset-normalizer", "orjson"]
 )
-def download_from_s3(
-    s3_endpoint: str,
-    s3_bucket: str,
-    s3_prefix: str,
-    s3_access_key: str,
-    s3_secret_key: str,
-    download_path: str = "/tmp/documents"
+def discover_and_ingest(
+    documents_path: str,
+    file_extensions: List[str],
+    service_url: str,
+    collection_name: str,
+    batch_size: int,
+    results: Output[Dataset],
+    diagnostics: Output[Dataset],
+    num_shards: int = 1,
+    shard_index: int = 0,
+    use_s3: bool = False,
+    s3_endpoint: str = "",
+    s3_bucket: str = "",
+    s3_prefix: str = "",
+    s3_access_key: str = "",
+    s3_secret_key: str = "",
+    download_workers: int = 32,
+    max_concurrent_batches: int = 4,
+    max_payload_mb: int = 64,
+    compress_requests: bool = False
 ):
     """
-    Download documents from S3/Minio to local storage
+    Discover documents and ingest them in batches via the vector-search-service API
+
+    Each shard walks the mounted path (or lists the S3 bucket) and keeps the
+    matching files whose path hashes to shard_index. Discovery feeds
+    ingestion directly: local files are queued once the walk finishes, and S3
+    objects are downloaded by a thread pool as listing pages arrive, so
+    batches are sent while the listing or download is still running. Files
+    are queued largest first (within each listing page for S3). S3 objects
+    are held in memory (spilling to disk only when large) rather than
+    written out and read back.
+
+    Files whose ETag (S3) or MD5 (local) the service already has, per the
+    documents:filter endpoint, are skipped; the hash is stored in each
+    document's metadata for the next run. Each batch is sent as a single
+    request to the bulk documents:batch endpoint. If the service doesn't
+    provide either endpoint, every file is sent, one request per document.
+
+    Documents that aren't valid UTF-8 are decoded with a detected charset
+    (e.g. latin-1 HTML); binary files are reported as failed without being
+    sent.
 
     Args:
+        documents_path: Mounted documents directory, or where large S3 objects spill to disk
+        file_extensions: List of file extensions to process
+        service_url: URL of the vector-search-service
+        collection_name: Name of the collection to ingest documents into
+        batch_size: Maximum number of documents per bulk request
+        results: Per-file ingestion results for this shard (NDJSON, ending with a summary line)
+        diagnostics: Files found and matched by this shard
+        num_shards: Number of shards the documents are split across
+        shard_index: Which shard to ingest
+        use_s3: If True, list and download from S3/Minio instead of walking documents_path
         s3_endpoint: S3 endpoint URL (e.g., https://minio.apps.cluster.com)
         s3_bucket: S3 bucket name
         s3_prefix: Prefix/folder in bucket (e.g., "kb/" or "")
         s3_access_key: S3 access key
         s3_secret_key: S3 secret key
-        download_path: Local path to download files to
+        download_workers: Number of objects to download concurrently (S3 mode)
+        max_concurrent_batches: Number of batches sent to the service concurrently
+        max_payload_mb: Split a batch if its serialized size exceeds this
+        compress_requests: Gzip request bodies (the service must accept
+            Content-Encoding: gzip)
     """
-    import boto3
+    import asyncio
+    import codecs
+    import contextlib
+    import hashlib
+    import io
+    import json
     import os
+    import queue
+    import tempfile
+    import time
+    import zlib
+    import aiohttp
+    import orjson
+    from concurrent.futures import ThreadPoolExecutor
     from pathlib import Path
 
-    print(f"Downloading from S3: {s3_endpoint}/{s3_bucket}/{s3_prefix}")
+    print(f"Processing shard {shard_index + 1} of {num_shards} in batches of {batch_size}")
+    print(f"Target collection: {collection_name}")
+    started = time.monotonic()
+
+    url = f"{service_url}/api/v1/collections/{collection_name}/documents"
+    max_payload_bytes = max_payload_mb * 1024 * 1024
+    bulk_supported = True
+    filter_supported = True
+
+    # str.endswith takes a tuple, matching every extension in one call
+    extensions = tuple(file_extensions)
+
+    # Request bodies are streamed from the file or spool in chunks of this many bytes,
+    # so memory use doesn't grow with document size
+    read_chunk_bytes = 1024 * 1024
+
+    # Body pieces are joined into writes of at least this many bytes, so a
+    # small document doesn't cost a thread hop and a socket write per piece
+    min_write_bytes = 64 * 1024
+
+    # S3 objects are held in memory up to this size on their way to the
+    # service, and only larger ones spill to a file under documents_path
+    spool_max_bytes = 1024 * 1024
+
+    # Each document gets this many seconds to upload and be embedded; a bulk
+    # request's budget grows with the documents in it
+    document_timeout = 300
+
+    # ETags per documents:filter query, keeping the query string short
+    filter_chunk_size = 100
+
+    # Document POSTs aren't idempotent: after a gateway timeout (502/504) or
+    # a connection dropped mid-request, the service may already have stored
+    # the documents, and resending would duplicate them. So only requests
+    # the service turned away (429/503) or that never reached it (connect
+    # errors) are retried, waiting as long as its Retry-After asks (capped)
+    max_retries = 3
+    retry_backoff = 0.2
+    max_retry_after = 60
+    retry_statuses = {429, 503}
+
+    # Batches in flight adapt to the service (AIMD): the limit is halved when
+    # it pushes back with 429/503, and grows by one after as many successful
+    # requests as the current limit, up to max_concurrent_batches. Requests
+    # already in flight report the same overload, so the limit is halved at
+    # most once per decrease_interval seconds
+    throttle_statuses = {429, 503}
+    decrease_interval = 1.0
+    batch_limit = max_concurrent_batches
+    batches_in_flight = 0
+    successes = 0
+    last_decrease = float('-inf')
+
+    # Files flow from the producer (walker or S3 downloader) to the ingester
+    # as (file_path, etag, spool, result): spool holds a downloaded S3 object
+    # (None for local files), and result is already set for files that won't
+    # be sent. The bound applies backpressure so discovery and downloads
+    # can't run arbitrarily far ahead of ingestion
+    file_queue = queue.Queue(maxsize=2 * batch_size)
+    end_of_files = None
 
-    # Create S3 client (Minio is S3-compatible)
-    s3_client = boto3.client(
-        's3',
-        endpoint_url=s3_endpoint,
-        aws_access_key_id=s3_access_key,
-        aws_secret_access_key=s3_secret_key,
-        verify=False  # For self-signed certs in dev/staging
-    )
+    all_files_found = []
+    matched_files = []
+
+    def in_shard(path):
+        # A stable hash (the builtin hash() is salted per process), so every
+        # pod agrees on the split and a file stays in its shard across runs.
+        # fsencode gives back the raw bytes of filenames that aren't UTF-8
+        return zlib.crc32(os.fsencode(path)) % num_shards == shard_index
+
+    def display_path(path):
+        """
+        path as valid UTF-8 for results, metadata and logs: bytes of filenames
+        that aren't UTF-8 are backslash-escaped (orjson rejects the surrogates
+        os.scandir uses for them). The original path is still used to read the file.
+        """
+        return os.fsencode(path).decode('utf-8', 'backslashreplace')
+
+    def walk(path):
+        """Yield file entries under path, using scandir's cached file types"""
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        yield from walk(entry.path)
+                    elif not entry.is_dir():
+                        # Like os.walk, don't descend into symlinked directories
+                        yield entry
+        except OSError as e:
+            print(f"  ERROR walking {path}: {e}")
+
+    def produce_from_path():
+        print(f"=== DISCOVERY DIAGNOSTICS ===")
+        print(f"Search path: {documents_path}")
+        print(f"Looking for extensions: {file_extensions}")
+        print(f"Path exists: {os.path.exists(documents_path)}")
+        print(f"Path is directory: {os.path.isdir(documents_path)}")
+
+        # List all contents
+        if os.path.exists(documents_path):
+            print(f"\nContents of {documents_path}:")
+            try:
+                for item in os.listdir(documents_path):
+                    full_path = os.path.join(documents_path, item)
+                    item_type = "DIR" if os.path.isdir(full_path) else "FILE"
+                    print(f"  [{item_type}] {item}")
+            except Exception as e:
+                print(f"  ERROR listing directory: {e}")
+        else:
+            print(f"  Path does not exist!")
+
+        # Queue the largest files first (longest-processing-time-first), so a
+        # big file found late doesn't leave one batch running long after the
+        # rest. The walk only reads metadata, so finishing it before queueing
+        # costs little; files are hashed at ingest time
+        matches = []
+        for entry in walk(documents_path):
+            all_files_found.append(display_path(entry.path))
+            if entry.name.endswith(extensions) and in_shard(entry.path):
+                try:
+                    size = entry.stat().st_size
+                except OSError:
+                    size = 0  # Reported when the file is read
+                matches.append((size, entry.path))
+
+        matches.sort(reverse=True)
+        for size, file_path in matches:
+            matched_files.append(display_path(file_path))
+            file_queue.put((file_path, None, None, None))
+
+    def produce_from_s3(loop, session):
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+        from botocore.config import Config
+
+        print(f"=== DISCOVERY DIAGNOSTICS ===")
+        print(f"Search location: {s3_endpoint}/{s3_bucket}/{s3_prefix}")
+        print(f"Looking for extensions: {file_extensions}")
+
+        # Large objects are fetched as parallel byte-range GETs; small ones
+        # (below the threshold) still go through a single request. Every
+        # download call runs its own transfer manager, so each worker can have
+        # max_concurrency ranged GETs in flight; it's kept low so that total
+        # stays bounded
+        MB = 1024 * 1024
+        transfer_config = TransferConfig(
+            multipart_threshold=8 * MB,
+            multipart_chunksize=8 * MB,
+            max_concurrency=4,
+            io_chunksize=1 * MB
+        )
 
-    # Create download directory
-    Path(download_path).mkdir(parents=True, exist_ok=True)
+        # Create S3 client (Minio is S3-compatible). The low-level client is
+        # thread-safe, so one instance is shared by all download workers. Its
+        # pool covers every worker fetching a large object at once, so ranged
+        # GETs don't overflow it and churn connections.
+        s3_client = boto3.client(
+            's3',
+            endpoint_url=s3_endpoint,
+            aws_access_key_id=s3_access_key,
+            aws_secret_access_key=s3_secret_key,
+            config=Config(
+                max_pool_connections=download_workers * transfer_config.max_concurrency
+            ),
+            verify=False  # For self-signed certs in dev/staging
+        )
 
-    # List and download all objects with the prefix
-    paginator = s3_client.get_paginator('list_objects_v2')
-    downloaded_count = 0
+        def download(s3_key, etag):
+            # Download into a spool rather than a file, so typical documents
+            # never touch disk, and the body can be re-read for retries
+            spool = tempfile.SpooledTemporaryFile(max_size=spool_max_bytes, dir=documents_path)
+            try:
+                s3_client.download_fileobj(
+                    s3_bucket, s3_key, spool, Config=transfer_config
+                )
+                file_queue.put((s3_key, etag, spool, None))
+            except Exception as e:
+                spool.close()
+                file_queue.put((s3_key, etag, None, failure(s3_key, f"Download failed: {e}")))
+
+        print(f"Downloading with {download_workers} workers")
+        Path(documents_path).mkdir(parents=True, exist_ok=True)
+        paginator = s3_client.get_paginator('list_objects_v2')
+
+        with ThreadPoolExecutor(max_workers=download_workers) as executor:
+            # Downloads start as each listing page arrives. Ask for the largest
+            # page S3 allows rather than relying on the server's default, so
+            # S3-compatible stores don't cost extra listing round trips
+            pages = paginator.paginate(
+                Bucket=s3_bucket,
+                Prefix=s3_prefix,
+                PaginationConfig={'PageSize': 1000}
+            )
+            for page in pages:
+                page_entries = []
+                for obj in page.get('Contents', []):
+                    s3_key = obj['Key']
+
+                    # Skip directory markers
+                    if s3_key.endswith('/'):
+                        continue
+
+                    all_files_found.append(s3_key)
+                    if s3_key.endswith(extensions) and in_shard(s3_key):
+                        matched_files.append(s3_key)
+                        page_entries.append((obj['Size'], s3_key, obj['ETag'].strip('"')))
+
+                # Start the largest downloads first, so they don't straggle
+                # behind the rest of the page
+                page_entries.sort(reverse=True)
+
+                # ETags are known from the listing, so skip unchanged objects
+                # before spending a download on them
+                known = asyncio.run_coroutine_threadsafe(
+                    known_etags(session, [etag for _, _, etag in page_entries]), loop
+                ).result()
+
+                for _, s3_key, etag in page_entries:
+                    if etag in known:
+                        file_queue.put((s3_key, etag, None, skipped(s3_key, etag)))
+                    else:
+                        executor.submit(download, s3_key, etag)
+
+    def produce(loop, session):
+        try:
+            if use_s3:
+                produce_from_s3(loop, session)
+            else:
+                produce_from_path()
+        finally:
+            file_queue.put(end_of_files)
+
+    def open_document(file_path, spool):
+        """Open a document for binary reading, from its S3 spool or the local file"""
+        if spool is None:
+            return open(file_path, 'rb')
+        spool.seek(0)
+        # Leave the spool open; it's read again for retries
+        return contextlib.nullcontext(spool)
+
+    def text_decoder(encoding):
+        """
+        Incremental decoder that also translates CRLF and CR newlines to LF,
+        as reading in text mode does, across chunk boundaries
+        """
+        return io.IncrementalNewlineDecoder(codecs.getincrementaldecoder(encoding)(), translate=True)
+
+    def escaped_size(text):
+        """Size of text once escaped as the inside of a JSON string"""
+        return len(orjson.dumps(text)) - 2
+
+    def detect_encoding(file_path, spool):
+        """
+        Detect the charset of a document that isn't valid UTF-8, and make sure
+        the whole document decodes with it. Returns the encoding and the
+        escaped size of the decoded text. Raises ValueError for binary files.
+        """
+        # Only needed on this error path, so UTF-8 documents never load it
+        from charset_normalizer import from_bytes
+
+        with open_document(file_path, spool) as f:
+            matches = from_bytes(f.read(read_chunk_bytes))
+        match = matches.best()
+        if match is None:
+            raise ValueError("Not a text document (binary content or unknown encoding)")
+
+        # Latin-1 text scores the same under several single-byte code pages,
+        # and best() just takes the first (cp1250, which turns "très" into
+        # "trčs"). Among the tied matches prefer cp1252, which is how browsers
+        # (WHATWG) decode latin-1/ISO-8859-1
+        encoding = match.encoding
+        tied = set()
+        for m in matches:
+            if m.chaos == match.chaos and m.coherence == match.coherence:
+                tied.add(m.encoding)
+                tied.update(m.could_be_from_charset)
+        if 'cp1252' in tied:
+            encoding = 'cp1252'
+
+        decoder = text_decoder(encoding)
+        size = 0
+        with open_document(file_path, spool) as f:
+            while chunk := f.read(read_chunk_bytes):
+                size += escaped_size(decoder.decode(chunk))
+        size += escaped_size(decoder.decode(b'', final=True))
+
+        print(f"NOTE: {Path(display_path(file_path)).name}: not valid UTF-8, decoding as {encoding}")
+        return encoding, size
+
+    def check_document(file_path, spool):
+        """
+        Work out how the document decodes without holding it in memory: as
+        UTF-8 where it's valid, otherwise with a detected charset. Returns the
+        size of its content once escaped into the JSON body (which can be
+        several times its size on disk), its MD5 (which matches the ETag of a
+        single-part S3 upload) and encoding.
+        """
+        decoder = text_decoder('utf-8')
+        digest = hashlib.md5()
+        size = 0
+        utf8 = True
+        with open_document(file_path, spool) as f:
+            while True:
+                chunk = f.read(read_chunk_bytes)
+                if utf8:
+                    try:
+                        size += escaped_size(decoder.decode(chunk, final=not chunk))
+                    except UnicodeDecodeError:
+                        utf8 = False
+                if not chunk:
+                    break
+                digest.update(chunk)
+
+        if utf8:
+            return size, digest.hexdigest(), 'utf-8'
+
+        encoding, size = detect_encoding(file_path, spool)
+        return size, digest.hexdigest(), encoding
+
+    def document_metadata(file_path, etag):
+        """Serialized metadata for one document"""
+        # Prepare request for vector-search-service
+        return orjson.dumps({
+            "source": "kubeflow-pipeline",
+            "file_path": display_path(file_path),
+            "filename": Path(display_path(file_path)).name,
+            "etag": etag
+        })
+
+    def document_chunks(file_path, etag, spool, encoding):
+        """Yield the JSON request body for one document, reading it in chunks"""
+        yield b'{"content": "'
+        decoder = text_decoder(encoding)
+        with open_document(file_path, spool) as f:
+            while chunk := f.read(read_chunk_bytes):
+                # Escape each chunk as the inside of a JSON string
+                yield orjson.dumps(decoder.decode(chunk))[1:-1]
+        yield orjson.dumps(decoder.decode(b'', final=True))[1:-1]
+
+        yield b'", "metadata": ' + document_metadata(file_path, etag) + b'}'
+
+    def payload_chunks(payload):
+        """Yield the bulk request body for a payload of documents"""
+        yield b'{"documents": ['
+        for i, document in enumerate(payload):
+            if i:
+                yield b', '
+            yield from document_chunks(*document)
+        yield b']}'
+
+    def coalesce_chunks(chunks):
+        """Join small chunks into writes of at least min_write_bytes"""
+        pending = []
+        pending_size = 0
+        for chunk in chunks:
+            pending.append(chunk)
+            pending_size += len(chunk)
+            if pending_size >= min_write_bytes:
+                yield b''.join(pending)
+                pending = []
+                pending_size = 0
+        if pending:
+            yield b''.join(pending)
+
+    def gzip_chunks(chunks):
+        """Gzip a chunk stream; level 1 keeps compression cheaper than the bytes it saves"""
+        compressor = zlib.compressobj(1, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
+
+    async def stream_body(chunks):
+        """Feed a blocking chunk generator to aiohttp without blocking the event loop"""
+        while True:
+            chunk = await asyncio.to_thread(next, chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+
+    def check_batch(batch):
+        """Check each document, filling in the content hash where there's no ETag"""
+        checked = []
+        failures = []
+
+        for file_path, etag, spool in batch:
+            try:
+                size, md5, encoding = check_document(file_path, spool)
+            except Exception as e:
+                print(f"ERROR: {display_path(file_path)}: {str(e)}")
+                failures.append({"file": display_path(file_path), "success": False, "error": str(e)})
+                continue
 
-    for page in paginator.paginate(Bucket=s3_bucket, Prefix=s3_prefix):
-        if 'Contents' not in page:
-            continue
+            # Count the whole serialized document against the payload limit
+            etag = etag or md5
+            size += len(b'{"content": "", "metadata": }, ') + len(document_metadata(file_path, etag))
+            checked.append((file_path, etag, spool, encoding, size))
 
-        for obj in page['Contents']:
-            s3_key = obj['Key']
+        return checked, failures
 
-            # Skip directory markers
-            if s3_key.endswith('/'):
-                continue
+    def split_payloads(checked):
+        """Split checked documents into payloads under the serialized size limit"""
+        payloads = [[]]
+        payload_size = 0
 
-            # Calculate local path (preserve directory structure)
-            relative_path = s3_key[len(s3_prefix):] if s3_prefix else s3_key
-            local_file = os.path.join(download_path, relative_path)
+        for *document, size in checked:
+            if payloads[-1] and payload_size + size > max_payload_bytes:
+                payloads.append([])
+                payload_size = 0
+            payloads[-1].append(tuple(document))
+            payload_size += size
 
-            # Create local directory if needed
-            Path(local_file).parent.mkdir(parents=True, exist_ok=True)
+        return [p for p in payloads if p]
 
-            # Download file
-            print(f"  Downloading: {s3_key} -> {local_file}")
-            s3_client.download_file(s3_bucket, s3_key, local_file)
-            downloaded_count += 1
+    def failure(file_path, error):
+        file_path = display_path(file_path)
+        print(f"FAILED: {Path(file_path).name}: {error}")
+        return {"file": file_path, "success": False, "error": error}
 
-    print(f"Downloaded {downloaded_count} files to {download_path}")
+    def success(file_path, doc_id):
+        file_path = display_path(file_path)
+        print(f"SUCCESS: {Path(file_path).name}: Document ID {doc_id}")
+        return {"file": file_path, "success": True, "document_id": doc_id}
 
+    def skipped(file_path, etag):
+        file_path = display_path(file_path)
+        print(f"SKIPPED: {Path(file_path).name}: already ingested ({etag})")
+        return {"file": file_path, "success": True, "skipped": True, "etag": etag}
 
-@component(
-    base_image="registry.access.redhat.com/ubi9/python-311:latest",
-    packages_to_install=["requests"]
-)
-def discover_documents(
-    documents_path: str,
-    file_extensions: List[str],
-    discovered_files: Output[Dataset],
-    diagnostics: Output[Dataset]
-):
-    """Discover all documents in the specified path"""
-    import os
-    import json
+    async def known_etags(session, etags):
+        """Return the subset of etags the service has already ingested"""
+        nonlocal filter_supported
 
-    print(f"=== DISCOVERY DIAGNOSTICS ===")
-    print(f"Search path: {documents_path}")
-    print(f"Looking for extensions: {file_extensions}")
-    print(f"Path exists: {os.path.exists(documents_path)}")
-    print(f"Path is directory: {os.path.isdir(documents_path)}")
+        known = set()
+        for i in range(0, len(etags), filter_chunk_size):
+            if not filter_supported:
+                break
 
-    # List all contents
-    if os.path.exists(documents_path):
-        print(f"\nContents of {documents_path}:")
+            query = ",".join(etags[i:i + filter_chunk_size])
+            try:
+                async with session.get(f"{url}:filter", params={"etags": query}) as response:
+                    if response.status in [404, 405]:
+                        # Concurrent batches may all hit this; only log the first
+                        if filter_supported:
+                            print(f"Filter endpoint unavailable (HTTP {response.status}), "
+                                  f"ingesting all files")
+                        filter_supported = False
+                    elif response.status == 200:
+                        known.update(orjson.loads(await response.read()).get('etags', []))
+                    else:
+                        print(f"Filter query failed (HTTP {response.status}), "
+                              f"ingesting these files")
+            except Exception as e:
+                print(f"Filter query failed ({e}), ingesting these files")
+
+        return known
+
+    def adjust_batch_limit(status):
+        """Feed a response status into the adaptive batch limit"""
+        nonlocal batch_limit, successes, last_decrease
+
+        if status in throttle_statuses:
+            successes = 0
+            now = asyncio.get_running_loop().time()
+            if batch_limit > 1 and now - last_decrease >= decrease_interval:
+                batch_limit //= 2
+                last_decrease = now
+                print(f"Service is overloaded (HTTP {status}), "
+                      f"reducing to {batch_limit} concurrent batches")
+        elif 200 <= status < 300:
+            successes += 1
+            if successes >= batch_limit and batch_limit < max_concurrent_batches:
+                batch_limit += 1
+                successes = 0
+
+    async def acquire_batch_slot(slots):
+        nonlocal batches_in_flight
+        async with slots:
+            await slots.wait_for(lambda: batches_in_flight < batch_limit)
+            batches_in_flight += 1
+
+    async def release_batch_slot(slots):
+        nonlocal batches_in_flight
+        async with slots:
+            batches_in_flight -= 1
+            slots.notify_all()
+
+    def retry_after(response):
+        """Seconds the service asked to wait before retrying, or 0"""
         try:
-            for item in os.listdir(documents_path):
-                full_path = os.path.join(documents_path, item)
-                item_type = "DIR" if os.path.isdir(full_path) else "FILE"
-                print(f"  [{item_type}] {item}")
+            return min(float(response.headers.get('Retry-After', 0)), max_retry_after)
+        except ValueError:
+            return 0  # HTTP-date form; use the backoff instead
+
+    async def post_json(session, post_url, make_chunks, documents=1):
+        """
+        POST a streamed JSON body of one or more documents, retrying requests
+        that were rejected or never sent, with exponential backoff or the
+        service's Retry-After. make_chunks is called again for each attempt.
+        """
+        timeout = aiohttp.ClientTimeout(total=document_timeout * documents, sock_connect=30)
+        headers = {"Content-Type": "application/json"}
+        if compress_requests:
+            headers["Content-Encoding"] = "gzip"
+
+        for attempt in range(max_retries + 1):
+            chunks = coalesce_chunks(make_chunks())
+            if compress_requests:
+                chunks = gzip_chunks(chunks)
+            delay = retry_backoff * 2 ** attempt
+
+            try:
+                async with session.post(
+                    post_url,
+                    data=stream_body(chunks),
+                    headers=headers,
+                    timeout=timeout
+                ) as response:
+                    adjust_batch_limit(response.status)
+                    if response.status not in retry_statuses or attempt == max_retries:
+                        return response.status, await response.text()
+                    delay = max(delay, retry_after(response))
+            except aiohttp.ClientConnectorError:
+                # Failed to connect, so nothing was sent
+                if attempt == max_retries:
+                    raise
+
+            await asyncio.sleep(delay)
+
+    def response_object(text):
+        """Parse a success response, which should be a JSON object"""
+        try:
+            body = orjson.loads(text)
+        except orjson.JSONDecodeError:
+            body = None
+        if not isinstance(body, dict):
+            raise ValueError(f"Unexpected response body: {text[:200]!r}")
+        return body
+
+    async def post_one(session, file_path, etag, spool, encoding):
+        try:
+            status, text = await post_json(
+                session, url, lambda: document_chunks(file_path, etag, spool, encoding)
+            )
+            if status in [200, 201]:
+                # vector-search-service returns document_id on success
+                return success(file_path, response_object(text).get('document_id', 'unknown'))
         except Exception as e:
-            print(f"  ERROR listing directory: {e}")
-    else:
-        print(f"  Path does not exist!")
+            return failure(file_path, str(e))
 
-    # Walk and discover
-    files = []
-    all_files_found = []
-    for root, dirs, filenames in os.walk(documents_path):
-        print(f"\nWalking: {root}")
-        print(f"  Subdirs: {dirs}")
-        print(f"  Files: {filenames}")
-
-        for filename in filenames:
-            full_path = os.path.join(root, filename)
-            all_files_found.append(full_path)
-
-            if any(filename.endswith(ext) for ext in file_extensions):
-                files.append(full_path)
-                print(f"  ✓ MATCHED: {filename}")
+        return failure(file_path, f"HTTP {status}: {text}")
+
+    async def post_payload(session, payload):
+        nonlocal bulk_supported
+
+        if bulk_supported:
+            try:
+                status, text = await post_json(
+                    session, f"{url}:batch", lambda: payload_chunks(payload), len(payload)
+                )
+                if status in [200, 201]:
+                    documents = response_object(text).get('documents', [])
+                    if not isinstance(documents, list):
+                        raise ValueError(f"Unexpected response body: {text[:200]!r}")
+                    doc_ids = [
+                        d.get('document_id', 'unknown') if isinstance(d, dict) else 'unknown'
+                        for d in documents
+                    ]
+            except Exception as e:
+                return [failure(file_path, str(e)) for file_path, *_ in payload]
+
+            if status in [200, 201]:
+                return [
+                    success(file_path, doc_ids[i] if i < len(doc_ids) else 'unknown')
+                    for i, (file_path, *_) in enumerate(payload)
+                ]
+
+            if status not in [404, 405]:
+                return [failure(file_path, f"HTTP {status}: {text}") for file_path, *_ in payload]
+
+            # Concurrent batches may all hit this; only log the first
+            if bulk_supported:
+                print(f"Bulk endpoint unavailable (HTTP {status}), "
+                      f"falling back to one request per document")
+            bulk_supported = False
+
+        return await asyncio.gather(
+            *(post_one(session, *document) for document in payload)
+        )
+
+    async def ingest_batch(session, slots, number, batch):
+        batch_results = []
+        try:
+            print(f"Processing batch {number}: {len(batch)} files")
+            checked, failures = await asyncio.to_thread(check_batch, batch)
+            batch_results.extend(failures)
+
+            # S3 files were already filtered by ETag before downloading
+            if not use_s3:
+                known = await known_etags(session, [c[1] for c in checked])
+                batch_results.extend(skipped(c[0], c[1]) for c in checked if c[1] in known)
+                checked = [c for c in checked if c[1] not in known]
+
+            for payload in split_payloads(checked):
+                batch_results.extend(await post_payload(session, payload))
+        except Exception as e:
+            # Fail whatever in this batch has no result yet, rather than
+            # letting one bad response take down the whole shard
+            done = {result["file"] for result in batch_results}
+            batch_results.extend(
+                failure(file_path, f"Unexpected error: {e}")
+                for file_path, _, _ in batch if display_path(file_path) not in done
+            )
+        finally:
+            for result in batch_results:
+                record(result)
+            for _, _, spool in batch:
+                if spool is not None:
+                    spool.close()
+            await release_batch_slot(slots)
+
+    async def main():
+        # One pooled session for all requests, so connections are kept alive
+        # and reused across batches. Sized to cover per-document fallback
+        # from every concurrent batch
+        slots = asyncio.Condition()
+        connector = aiohttp.TCPConnector(limit=max_concurrent_batches * batch_size)
+        # Default for filter queries; document POSTs set their own, per payload
+        timeout = aiohttp.ClientTimeout(total=document_timeout, sock_connect=30)
+        tasks = []
+
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            producer = asyncio.create_task(
+                asyncio.to_thread(produce, asyncio.get_running_loop(), session)
+            )
+            done = False
+            while not done:
+                # Wait for a free batch slot before pulling more files, so a
+                # slow service backs up the queue and pauses the producer
+                await acquire_batch_slot(slots)
+                batch = []
+                while len(batch) < batch_size:
+                    # Only hand off to a thread when the queue has to be waited on
+                    try:
+                        item = file_queue.get_nowait()
+                    except queue.Empty:
+                        item = await asyncio.to_thread(file_queue.get)
+                    if item is end_of_files:
+                        done = True
+                        break
+                    file_path, etag, spool, result = item
+                    if result:
+                        record(result)
+                    else:
+                        batch.append((file_path, etag, spool))
+
+                if batch:
+                    tasks.append(asyncio.create_task(
+                        ingest_batch(session, slots, len(tasks) + 1, batch)
+                    ))
+                else:
+                    await release_batch_slot(slots)
+
+            await producer
+            await asyncio.gather(*tasks)
+
+    # Save results as NDJSON, one record per file as it completes, so
+    # neither this step nor verify_ingestion holds them all in memory
+    counts = {"total": 0, "successful": 0, "failed": 0, "skipped": 0}
+
+    with open(results.path, 'wb') as results_file:
+        def record(result):
+            results_file.write(orjson.dumps(result) + b"\n")
+            counts["total"] += 1
+            if result.get("skipped"):
+                counts["skipped"] += 1
+            elif result["success"]:
+                counts["successful"] += 1
             else:
-                print(f"  ✗ SKIPPED: {filename}")
+                counts["failed"] += 1
+
+        asyncio.run(main())
+        summary = dict(counts, elapsed_seconds=round(time.monotonic() - started, 3))
+        results_file.write(orjson.dumps({"__summary__": summary}) + b"\n")
 
     print(f"\n=== SUMMARY ===")
     print(f"Total files found: {len(all_files_found)}")
-    print(f"Matching files: {len(files)}")
-    print(f"Discovered {len(files)} files")
+    print(f"Matching files in this shard: {len(matched_files)}")
 
     # Save diagnostics
     diag_data = {
-        "search_path": documents_path,
+        "search_path": f"s3://{s3_bucket}/{s3_prefix}" if use_s3 else documents_path,
         "extensions": file_extensions,
-        "path_exists": os.path.exists(documents_path),
+        "path_exists": True if use_s3 else os.path.exists(documents_path),
+        "shard": shard_index,
         "total_files_found": len(all_files_found),
-        "matching_files": len(files),
+        "matching_files": len(matched_files),
         "all_files": all_files_found,
-        "matched_files": files
+        "matched_files": matched_files
     }
 
     with open(diagnostics.path, 'w') as f:
         json.dump(diag_data, f, indent=2)
 
-    # Write discovered files to output
-    with open(discovered_files.path, 'w') as f:
-        json.dump(files, f)
-
-
-@component(
-    base_image="registry.access.redhat.com/ubi9/python-311:latest",
-    packages_to_install=["requests"]
-)
-def ingest_document_batch(
-    discovered_files: Input[Dataset],
-    service_url: str,
-    collection_name: str,
-    batch_size: int,
-    results: Output[Dataset]
-):
-    """Ingest documents in batches via the vector-search-service API"""
-    import json
-    import requests
-    from pathlib import Path
-
-    # Load discovered files
-    with open(discovered_files.path, 'r') as f:
-        files = json.load(f)
-
-    print(f"Processing {len(files)} files in batches of {batch_size}")
-    print(f"Target collection: {collection_name}")
-
-    batch_results = []
-    successful = 0
-    failed = 0
-
-    # Process in batches
-    for i in range(0, len(files), batch_size):
-        batch = files[i:i + batch_size]
-        print(f"Processing batch {i//batch_size + 1}: {len(batch)} files")
-
-        for file_path in batch:
-            try:
-                # Read file content as text
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    file_content = f.read()
-
-                # Prepare request for vector-search-service
-                filename = Path(file_path).name
-                payload = {
-                    "content": file_content,
-                    "metadata": {
-                        "source": "kubeflow-pipeline",
-                        "file_path": file_path,
-                        "filename": filename
-                    }
-                }
-
-                # Send to vector-search-service collection endpoint
-                response = requests.post(
-                    f"{service_url}/api/v1/collections/{collection_name}/documents",
-                    json=payload,
-                    headers={"Content-Type": "application/json"},
-                    timeout=300  # Increased for large files
-                )
-
-                if response.status_code in [200, 201]:
-                    result = response.json()
-                    # vector-search-service returns document_id on success
-                    doc_id = result.get('document_id', 'unknown')
-                    print(f"SUCCESS: {filename}: Document ID {doc_id}")
-                    batch_results.append({
-                        "file": file_path,
-                        "success": True,
-                        "document_id": doc_id
-                    })
-                    successful += 1
-                else:
-                    error_detail = response.text
-                    print(f"FAILED: {filename}: HTTP {response.status_code} - {error_detail}")
-                    batch_results.append({
-                        "file": file_path,
-                        "success": False,
-                        "error": f"HTTP {response.status_code}: {error_detail}"
-                    })
-                    failed += 1
-
-            except Exception as e:
-                print(f"ERROR: {file_path}: {str(e)}")
-                batch_results.append({
-                    "file": file_path,
-                    "success": False,
-                    "error": str(e)
-                })
-                failed += 1
-
-    # Save results
-    summary = {
-        "total": len(files),
-        "successful": successful,
-        "failed": failed,
-        "results": batch_results
-    }
-
-    with open(results.path, 'w') as f:
-        json.dump(summary, f, indent=2)
-
-    print(f"\nSummary: {successful}/{len(files)} files ingested successfully")
+    print(f"\nSummary: {counts['successful']}/{counts['total']} files ingested successfully, "
+          f"{counts['skipped']} unchanged files skipped")
 
 
 @component(
@@ -263,22 +818,46 @@ def ingest_document_batch(
     packages_to_install=["psycopg2-binary"]
 )
 def verify_ingestion(
-    results: Input[Dataset],
+    results: Input[List[Dataset]],
     db_host: str,
     db_port: str,
     db_user: str,
     db_password: str,
-    db_name: str
+    db_name: str,
+    metrics: Output[Metrics],
+    db_sslmode: str = "disable"
 ):
-    """Verify documents were created in the database"""
+    """
+    Verify documents were created in the database, and log the ingestion
+    and database counts as KFP metrics so they can be compared across runs
+    """
     import json
     import psycopg2
 
-    # Load results
-    with open(results.path, 'r') as f:
-        summary = json.load(f)
+    # Load results from every shard
+    successful = 0
+    failed = 0
+    skipped = 0
+    elapsed_seconds = 0.0
+    for shard_results in results:
+        with open(shard_results.path, 'r') as f:
+            for line in f:
+                result = json.loads(line)
+                if "__summary__" in result:
+                    # Shards run in parallel, so the slowest one sets the wall time
+                    elapsed_seconds = max(
+                        elapsed_seconds, result["__summary__"].get("elapsed_seconds", 0)
+                    )
+                    continue
+                if result.get("skipped"):
+                    skipped += 1
+                elif result["success"]:
+                    successful += 1
+                else:
+                    failed += 1
 
-    print(f"Ingestion results: {summary['successful']} successful, {summary['failed']} failed")
+    print(f"Ingestion results: {successful} successful, {failed} failed, "
+          f"{skipped} skipped (unchanged) across {len(results)} shards")
 
     # Connect to database
     conn = psycopg2.connect(
@@ -286,33 +865,47 @@ def verify_ingestion(
         port=db_port,
         user=db_user,
         password=db_password,
-        database=db_name
+        database=db_name,
+        sslmode=db_sslmode
     )
 
     cur = conn.cursor()
 
-    # Query document statistics (vector-search-service tables)
+    # Query document and embedding statistics (vector-search-service tables)
+    # in a single round trip
     cur.execute("""
-        SELECT
-            COUNT(*) as total_documents,
-            COUNT(DISTINCT collection_id) as total_collections
-        FROM documents
-    """)
-
-    doc_stats = cur.fetchone()
-
-    # Query embedding statistics
-    cur.execute("""
-        SELECT COUNT(*) as total_embeddings
-        FROM embeddings
+        WITH doc_stats AS (
+            SELECT
+                COUNT(*) as total_documents,
+                COUNT(DISTINCT collection_id) as total_collections
+            FROM documents
+        ),
+        emb_stats AS (
+            SELECT COUNT(*) as total_embeddings
+            FROM embeddings
+        )
+        SELECT total_documents, total_collections, total_embeddings
+        FROM doc_stats, emb_stats
     """)
 
-    emb_stats = cur.fetchone()
+    total_documents, total_collections, total_embeddings = cur.fetchone()
 
     print(f"\nDatabase Statistics:")
-    print(f"  Total documents: {doc_stats[0]}")
-    print(f"  Total collections: {doc_stats[1]}")
-    print(f"  Total embeddings: {emb_stats[0]}")
+    print(f"  Total documents: {total_documents}")
+    print(f"  Total collections: {total_collections}")
+    print(f"  Total embeddings: {total_embeddings}")
+
+    metrics.log_metric("successful_documents", successful)
+    metrics.log_metric("failed_documents", failed)
+    metrics.log_metric("skipped_documents", skipped)
+    metrics.log_metric("ingest_seconds", elapsed_seconds)
+    metrics.log_metric(
+        "ingest_rate",
+        round(successful / elapsed_seconds, 3) if elapsed_seconds else 0
+    )
+    metrics.log_metric("total_documents", total_documents)
+    metrics.log_metric("total_collections", total_collections)
+    metrics.log_metric("total_embeddings", total_embeddings)
 
     cur.close()
     conn.close()
@@ -325,7 +918,7 @@ def verify_ingestion(
 def document_ingestion_pipeline(
     # Document source configuration
     use_s3: bool = True,
-    documents_path: str = "/tmp/documents",  # Local path after S3 download or mounted PVC
+    documents_path: str = "/tmp/documents",  # Mounted PVC, or spill directory for large S3 objects
     file_extensions: list = [".md", ".txt", ".html"],
 
     # S3/Minio configuration (only used if use_s3=True)
@@ -334,25 +927,30 @@ def document_ingestion_pipeline(
     s3_prefix: str = "",
     s3_access_key: str = "",
     s3_secret_key: str = "",
+    download_workers: int = 32,
 
     # Service configuration (cluster-internal URLs)
     service_url: str = "http://vector-search-service.servicenow-ai-poc.svc.cluster.local:8000",
     collection_name: str = "default",
     batch_size: int = 10,
+    max_concurrent_batches: int = 4,
+    num_shards: int = 4,
+    compress_requests: bool = False,
 
     # Database configuration (cluster-internal)
     db_host: str = "postgres-pgvector.servicenow-ai-poc.svc.cluster.local",
     db_port: str = "5432",
     db_user: str = "raguser",
     db_password: str = "",  # MUST be provided
-    db_name: str = "ragdb"
+    db_name: str = "ragdb",
+    db_sslmode: str = "disable"  # Cluster-internal traffic; use "require" or stricter otherwise
 ):
     """
     Main pipeline for document ingestion
 
     Args:
-        use_s3: If True, download from S3/Minio first. If False, use documents_path directly
-        documents_path: Path to documents directory (destination for S3 or mounted PVC)
+        use_s3: If True, stream documents from S3/Minio. If False, use documents_path directly
+        documents_path: Path to documents directory (mounted PVC, or spill directory for S3 objects over 1MB)
         file_extensions: List of file extensions to process
 
         s3_endpoint: S3 endpoint URL (e.g., https://your-minio-endpoint)
@@ -360,55 +958,65 @@ def document_ingestion_pipeline(
         s3_prefix: Prefix/folder in bucket (e.g., "kb/")
         s3_access_key: S3 access key
         s3_secret_key: S3 secret key
+        download_workers: Number of S3 objects to download concurrently
 
         service_url: URL of the vector-search-service (cluster-internal)
         collection_name: Name of the collection to ingest documents into
-        batch_size: Number of documents to process in each batch
+        batch_size: Maximum number of documents sent in each bulk request
+        max_concurrent_batches: Number of batches sent to the service concurrently (per shard)
+        num_shards: Number of parallel ingest pods to split the documents across
+        compress_requests: Gzip request bodies (requires the service to accept Content-Encoding: gzip)
 
         db_host: PostgreSQL host (cluster-internal)
         db_port: PostgreSQL port
         db_user: PostgreSQL user
         db_password: PostgreSQL password (required)
         db_name: PostgreSQL database name
+        db_sslmode: libpq sslmode for the database connection ("disable" skips
+            the TLS handshake on the cluster-internal network)
     """
 
-    # Step 0: Download from S3/Minio if enabled (conditional)
-    with dsl.If(use_s3 == True):
-        download_task = download_from_s3(
+    # Step 1: Plan the shards to fan out over. Pure function of num_shards,
+    # so it's safe to cache
+    shards_task = plan_shards(num_shards=num_shards)
+
+    # Step 2: Discover and ingest each shard in its own pod. Files are sent
+    # as they're found (or downloaded, with S3), with no file list handed
+    # between steps
+    with dsl.ParallelFor(shards_task.output) as shard_index:
+        ingest_task = discover_and_ingest(
+            documents_path=documents_path,
+            file_extensions=file_extensions,
+            num_shards=num_shards,
+            shard_index=shard_index,
+            use_s3=use_s3,
             s3_endpoint=s3_endpoint,
             s3_bucket=s3_bucket,
             s3_prefix=s3_prefix,
             s3_access_key=s3_access_key,
             s3_secret_key=s3_secret_key,
-            download_path=documents_path
+            download_workers=download_workers,
+            service_url=service_url,
+            collection_name=collection_name,
+            batch_size=batch_size,
+            max_concurrent_batches=max_concurrent_batches,
+            compress_requests=compress_requests
         )
-        download_task.set_caching_options(False)
-
-    # Step 1: Discover documents
-    discover_task = discover_documents(
-        documents_path=documents_path,
-        file_extensions=file_extensions
-    )
-    discover_task.set_caching_options(False)
-
-    # Step 2: Ingest documents in batches
-    ingest_task = ingest_document_batch(
-        discovered_files=discover_task.outputs["discovered_files"],
-        service_url=service_url,
-        collection_name=collection_name,
-        batch_size=batch_size
-    )
-    ingest_task.set_caching_options(False)
+        # Reads bucket/PVC contents that KFP's cache key can't see, and has
+        # side effects; reruns skip unchanged documents by ETag instead
+        ingest_task.set_caching_options(False)
 
-    # Step 3: Verify ingestion
+    # Step 3: Verify ingestion once every shard has finished
     verify_task = verify_ingestion(
-        results=ingest_task.outputs["results"],
+        results=dsl.Collected(ingest_task.outputs["results"]),
         db_host=db_host,
         db_port=db_port,
         db_user=db_user,
         db_password=db_password,
-        db_name=db_name
+        db_name=db_name,
+        db_sslmode=db_sslmode
     )
+    # Reports live database state, and its inputs are fresh every run anyway
     verify_task.set_caching_options(False)
 
 